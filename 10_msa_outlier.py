@@ -5,14 +5,152 @@
 # The user should contact martin.coetzee@up.ac.za should he/she want to use it for their research.
 
 import os
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from Bio import AlignIO
-from Bio.Phylo.TreeConstruction import DistanceCalculator
 import argparse
-from scipy import stats
+from scipy.spatial.distance import pdist
+import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from pathlib import Path
 
+# Numba is optional; without it distances fall back to scipy's pdist
+try:
+    from numba import config as numba_config, njit, prange, get_num_threads, set_num_threads
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+# CuPy is optional, only used when --gpu is given, and imported lazily by _load_cupy
+_cupy = None
+
+# Alignment files smaller than this are grouped by length so they can share one kernel call;
+# each group holds at most BATCH_MAX_FILES files, which bounds the memory a worker holds at once
+BATCH_FILE_BYTES = 1 << 20
+BATCH_MAX_FILES = 16
+
+# Rows per tile in the pairwise kernel; two 64-row tiles of a ~4 kb alignment fit in L2
+TILE_SIZE = 64
+
+if HAVE_NUMBA:
+    # Explicit signatures compile the kernels at import (cached in __pycache__) instead of on first call
+    @njit('float32[::1](uint8[:, ::1], int64)', parallel=True, cache=True, fastmath=True)
+    def _hamming_condensed(arr, n_threads):
+        """
+        Return the condensed (upper-triangle) vector of mismatch fractions between rows of arr.
+        n_threads is numba.get_num_threads(), passed in so the compiled kernel can be cached.
+        """
+        n, length = arr.shape
+        out = np.empty(n * (n - 1) // 2, dtype=np.float32)
+        tile_size = TILE_SIZE
+        n_tiles = (n + tile_size - 1) // tile_size
+        
+        if n_tiles < n_threads:
+            # Too few tiles to keep every thread busy, so parallelize over rows instead
+            for i in prange(n):
+                # Offset of pair (i, i + 1) in pdist's condensed ordering
+                row_start = n * i - i * (i + 1) // 2 - i - 1
+                for j in range(i + 1, n):
+                    c = 0
+                    for k in range(length):
+                        c += arr[i, k] != arr[j, k]
+                    out[row_start + j] = c / length
+            return out
+        
+        # One work item per (row tile, column tile) pair in the upper triangle, so the
+        # triangular workload is spread evenly and both tiles stay in cache while compared
+        n_pairs = n_tiles * (n_tiles + 1) // 2
+        tile_rows = np.empty(n_pairs, dtype=np.int64)
+        tile_cols = np.empty(n_pairs, dtype=np.int64)
+        p = 0
+        for ti in range(n_tiles):
+            for tj in range(ti, n_tiles):
+                tile_rows[p] = ti
+                tile_cols[p] = tj
+                p += 1
+        for p in prange(n_pairs):
+            ii = tile_rows[p] * tile_size
+            jj = tile_cols[p] * tile_size
+            for i in range(ii, min(ii + tile_size, n)):
+                row_start = n * i - i * (i + 1) // 2 - i - 1
+                for j in range(max(jj, i + 1), min(jj + tile_size, n)):
+                    c = 0
+                    for k in range(length):
+                        c += arr[i, k] != arr[j, k]
+                    out[row_start + j] = c / length
+        return out
+
+    @njit('float32[::1](uint8[:, ::1], int64[::1], int64[::1])', parallel=True, cache=True, fastmath=True)
+    def _hamming_condensed_blocks(arr, row_offsets, out_offsets):
+        """Return condensed distances within each block of rows of arr, concatenated; pairs across blocks are skipped."""
+        total_rows, length = arr.shape
+        out = np.empty(out_offsets[-1], dtype=np.float32)
+        # Parallelize over rows rather than blocks so a few large blocks still use every thread
+        for r in prange(total_rows):
+            b = np.searchsorted(row_offsets, r, side='right') - 1
+            start = row_offsets[b]
+            n = row_offsets[b + 1] - start
+            i = r - start
+            # Offset of pair (i, i + 1) in this block's condensed ordering
+            idx = out_offsets[b] + n * i - i * (i + 1) // 2
+            for j in range(r + 1, start + n):
+                c = 0
+                for k in range(length):
+                    c += arr[r, k] != arr[j, k]
+                out[idx] = c / length
+                idx += 1
+        return out
+
+# Upper bound on the boolean comparison temporary built for each row tile on the GPU
+GPU_TILE_BYTES = 1 << 30
+
+def _load_cupy():
+    """Import CuPy on first use; return the module, or None if it is missing or no GPU is usable."""
+    global _cupy
+    if _cupy is None:
+        try:
+            import cupy
+            if cupy.cuda.runtime.getDeviceCount() < 1:
+                raise RuntimeError("no CUDA device found")
+            _cupy = cupy
+        except Exception:
+            _cupy = False
+    return _cupy or None
+
+def _hamming_gpu(arr):
+    """Calculate condensed mismatch fractions between rows of arr on the GPU, one tile of rows at a time."""
+    cp = _load_cupy()
+    n, length = arr.shape
+    x = cp.asarray(arr)
+    out = np.empty(n * (n - 1) // 2, dtype=np.float32)
+    rows_per_tile = max(1, GPU_TILE_BYTES // max(1, n * length))
+    cols = cp.arange(n)
+    for start in range(0, n, rows_per_tile):
+        stop = min(start + rows_per_tile, n)
+        tile = cp.not_equal(x[start:stop, None, :], x[None, :, :]).sum(-1, dtype=cp.float32) / length
+        # Keep pairs (i, j) with j > i; in row-major order these follow pdist's condensed layout
+        upper = tile[cols[None, :] > cp.arange(start, stop)[:, None]]
+        offset = start * n - start * (start + 1) // 2
+        out[offset:offset + upper.size] = cp.asnumpy(upper)
+    return out
+
+def _condensed_row_sums(condensed, n):
+    """Sum each sequence's distances to all others directly from a condensed distance vector."""
+    # Accumulate in float64: each row's terms are added in a different order, and float32
+    # round-off would make equal sums differ enough to produce spurious z-scores
+    row_sums = np.zeros(n, dtype=np.float64)
+    start = 0
+    for i in range(n - 1):
+        # condensed[start:start + k] holds the distances from sequence i to sequences i+1..n-1
+        k = n - 1 - i
+        row = condensed[start:start + k]
+        row_sums[i] += row.sum(dtype=np.float64)
+        row_sums[i + 1:] += row
+        start += k
+    return row_sums.astype(condensed.dtype)
+
 def parse_arguments():
     """Parse command line arguments with sensible defaults for testing."""
     parser = argparse.ArgumentParser(description='Detect outlier sequences in multiple sequence alignments.')
@@ -20,146 +158,362 @@ def parse_arguments():
     parser.add_argument('--output_dir', default='outlier_results', help='Directory to save results (default: outlier_results)')
     parser.add_argument('--z_threshold', type=float, default=3.0, 
                         help='Z-score threshold for outlier detection (default: 3.0)')
-    parser.add_argument('--plot', action='store_true', help='Generate distance distribution plots')
+    parser.add_argument('--plot', action='store_true',
+                        help='Generate distance distribution plots (only for alignments with outliers)')
+    parser.add_argument('--plot_all', action='store_true',
+                        help='Generate distance distribution plots for every alignment, including those without outliers')
     parser.add_argument('--show_plots', action='store_true', help='Display plots interactively')
+    parser.add_argument('--gpu', action='store_true',
+                        help='Calculate distance matrices on the GPU (requires CuPy)')
     return parser.parse_args()
 
+def _read_fasta(file_path):
+    """Yield (sequence_id, sequence_chunks) for each record in a FASTA file, read as raw bytes."""
+    seq_id, chunks = None, []
+    with open(file_path, 'rb') as handle:
+        for line in handle:
+            if line.startswith(b'>'):
+                if seq_id is not None:
+                    yield seq_id, chunks
+                # Like Biopython, the id is the header up to the first whitespace
+                header = line[1:].split(None, 1)
+                seq_id = header[0].decode() if header else ''
+                chunks = []
+            elif seq_id is not None:
+                # Biopython drops spaces, tabs and line endings anywhere in sequence lines
+                chunk = line.translate(None, b' \t\r\n')
+                if chunk:
+                    chunks.append(chunk)
+            elif line.strip():
+                raise ValueError("Expected FASTA record starting with '>'")
+    if seq_id is not None:
+        yield seq_id, chunks
+
+def _first_record_length(file_path):
+    """Return the length of the first sequence in a FASTA file, or None if it cannot be read."""
+    try:
+        for _, chunks in _read_fasta(file_path):
+            return sum(len(chunk) for chunk in chunks)
+    except (OSError, ValueError):
+        pass
+    return None
+
+def group_alignment_files(file_paths):
+    """
+    Split alignment files into tasks for the worker pool.
+    Small files with the same alignment length are grouped (up to BATCH_MAX_FILES per group);
+    every other file is a task of its own. Tasks keep the order of their first file.
+    """
+    tasks = []
+    open_groups = {}
+    for file_path in file_paths:
+        length = None
+        if os.path.getsize(file_path) < BATCH_FILE_BYTES:
+            length = _first_record_length(file_path)
+        if length is None:
+            tasks.append([file_path])
+            continue
+        group = open_groups.get(length)
+        if group is None or len(group) >= BATCH_MAX_FILES:
+            group = open_groups[length] = []
+            tasks.append(group)
+        group.append(file_path)
+    return tasks
+
+def results_in_input_order(file_paths, tasks, task_results):
+    """
+    Yield per-file results in file_paths order from per-task results arriving in task order.
+    Each result is yielded as soon as it and every file before it are done; only early ones are held back.
+    """
+    position = {file_path: i for i, file_path in enumerate(file_paths)}
+    pending = {}
+    next_position = 0
+    for task, results in zip(tasks, task_results):
+        for file_path, result in zip(task, results):
+            pending[position[file_path]] = result
+        while next_position in pending:
+            yield pending.pop(next_position)
+            next_position += 1
+
 def load_alignment(file_path):
-    """Load a multiple sequence alignment from a FASTA file."""
+    """
+    Load a multiple sequence alignment from a FASTA file.
+    Returns (sequence_ids, arr) where arr is a contiguous (N, L) uint8 array with one row per sequence.
+    """
     try:
-        # Auto-detect format - FASTA is most common but this allows flexibility
-        alignment = AlignIO.read(file_path, "fasta")
-        return alignment
+        # First pass: count records and check that all sequences are the same length
+        n_sequences = 0
+        alignment_length = None
+        for _, chunks in _read_fasta(file_path):
+            length = sum(len(chunk) for chunk in chunks)
+            if alignment_length is None:
+                alignment_length = length
+            elif length != alignment_length:
+                raise ValueError("Sequences must all be the same length")
+            n_sequences += 1
+        if n_sequences == 0:
+            raise ValueError("No records found in handle")
+        
+        # Second pass: copy each sequence straight into its row of the preallocated array
+        sequence_ids = []
+        arr = np.empty((n_sequences, alignment_length), dtype=np.uint8, order='C')
+        for i, (seq_id, chunks) in enumerate(_read_fasta(file_path)):
+            sequence_ids.append(seq_id)
+            pos = 0
+            for chunk in chunks:
+                arr[i, pos:pos + len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+                pos += len(chunk)
+        return sequence_ids, arr
     except Exception as e:
         print(f"Error loading alignment from {file_path}: {e}")
-        return None
+        return None, None
 
-def calculate_distance_matrix(alignment, model="identity"):
-    """Calculate the distance matrix for the alignment using specified model."""
-    calculator = DistanceCalculator(model)
+def calculate_distance_matrix(arr, model="identity", use_gpu=False):
+    """
+    Calculate pairwise distances for an (N, L) uint8 alignment array, on the GPU if use_gpu is set.
+    Returns the upper triangle as a condensed float32 vector in scipy's pdist ordering.
+    """
+    if model != "identity":
+        print(f"Error calculating distance matrix: unsupported model '{model}'")
+        return None
     try:
-        # Calculate the distance matrix
-        distance_matrix = calculator.get_distance(alignment)
+        # Hamming distance (fraction of mismatching sites) equals identity distance
+        if use_gpu and _load_cupy() is not None:
+            try:
+                return _hamming_gpu(arr)
+            except Exception as e:
+                # e.g. out of GPU memory; the CPU result is identical, just slower
+                print(f"Warning: GPU distance calculation failed ({e}); using the CPU instead.")
+        if HAVE_NUMBA:
+            distance_matrix = _hamming_condensed(arr, get_num_threads())
+        else:
+            distance_matrix = pdist(arr, metric='hamming').astype(np.float32, copy=False)
         return distance_matrix
     except Exception as e:
         print(f"Error calculating distance matrix: {e}")
         return None
 
+def calculate_distance_matrices(arrs, use_gpu=False):
+    """
+    Calculate condensed distances for several (N, L) uint8 alignment arrays.
+    With Numba, arrays of the same length are stacked and handled in a single kernel call.
+    On the GPU each alignment is handled separately.
+    """
+    distances = [None] * len(arrs)
+    groups = {}
+    for idx, arr in enumerate(arrs):
+        groups.setdefault(arr.shape[1], []).append(idx)
+    
+    for indices in groups.values():
+        # pdist has no block-diagonal mode, so without Numba each alignment is handled separately
+        if use_gpu or not HAVE_NUMBA or len(indices) == 1:
+            for idx in indices:
+                distances[idx] = calculate_distance_matrix(arrs[idx], use_gpu=use_gpu)
+            continue
+        
+        sizes = np.array([arrs[idx].shape[0] for idx in indices], dtype=np.int64)
+        row_offsets = np.concatenate(([0], np.cumsum(sizes)))
+        out_offsets = np.concatenate(([0], np.cumsum(sizes * (sizes - 1) // 2)))
+        try:
+            out = _hamming_condensed_blocks(np.vstack([arrs[idx] for idx in indices]), row_offsets, out_offsets)
+        except Exception as e:
+            print(f"Error calculating distance matrix: {e}")
+            continue
+        # Copy each alignment's slice out of the shared buffer so it can be freed on its own
+        for k, idx in enumerate(indices):
+            distances[idx] = out[out_offsets[k]:out_offsets[k + 1]].copy()
+        del out
+    
+    return distances
+
 def analyze_distances(distance_matrix, sequence_ids, z_threshold=3.0):
     """
     Analyze the distance matrix to identify potential outlier sequences.
-    Returns a list of (sequence_id, avg_distance, z_score) tuples for outliers.
+    Expects the condensed float32 distance vector from calculate_distance_matrix.
+    Returns a list of (sequence_id, avg_distance, z_score) tuples for outliers,
+    along with the per-sequence averages, z-scores, the outlier row indices and
+    the mean and standard deviation of the averages.
     """
     n_sequences = len(sequence_ids)
     
-    # Calculate average distance for each sequence to all others
-    avg_distances = []
-    for i in range(n_sequences):
-        # Extract distances from one sequence to all others (excluding self-comparison)
-        seq_distances = [distance_matrix[i, j] for j in range(n_sequences) if i != j]
-        avg_distance = np.mean(seq_distances)
-        avg_distances.append(avg_distance)
+    # Average distance for each sequence to all others
+    avg_distances = _condensed_row_sums(distance_matrix, n_sequences) / (n_sequences - 1)
     
-    # Calculate Z-scores for average distances
-    z_scores = stats.zscore(avg_distances)
+    # Calculate Z-scores for average distances (population std, as scipy's zscore), in float64
+    # so the spread is not swamped by float32 round-off
+    mean_distance = avg_distances.mean(dtype=np.float64)
+    std_distance = avg_distances.std(dtype=np.float64)
+    if std_distance > np.finfo(np.float32).eps * mean_distance:
+        z_scores = ((avg_distances - mean_distance) / std_distance).astype(avg_distances.dtype)
+    else:
+        # All sequences are equally distant up to round-off, so none can be an outlier
+        z_scores = np.zeros_like(avg_distances)
     
     # Identify outliers based on Z-score threshold
-    outliers = []
-    for i, (avg_dist, z_score) in enumerate(zip(avg_distances, z_scores)):
-        if z_score > z_threshold:
-            outliers.append((sequence_ids[i], avg_dist, z_score))
+    outlier_indices = np.where(z_scores > z_scores.dtype.type(z_threshold))[0]
+    outliers = list(zip(np.asarray(sequence_ids)[outlier_indices],
+                        avg_distances[outlier_indices], z_scores[outlier_indices]))
     
-    return outliers, avg_distances, z_scores
+    return outliers, avg_distances, z_scores, outlier_indices, mean_distance, std_distance
+
+# Figure reused for every plot drawn in this process; see get_plot_figure
+_plot_figure = None
 
-def plot_distance_distribution(avg_distances, z_scores, sequence_ids, outliers, alignment_name, output_dir, show_plot=False):
-    """Generate a plot showing the distribution of average distances and outliers."""
-    plt.figure(figsize=(12, 8))
+def get_plot_figure():
+    """
+    Return this process's reusable plot figure, creating it on first use.
+    It is not managed by pyplot, so it is never shown and needs no GUI backend.
+    """
+    global _plot_figure
+    if _plot_figure is None:
+        _plot_figure = Figure(figsize=(12, 8))
+    return _plot_figure
+
+def plot_distance_distribution(fig, avg_distances, z_scores, mean_distance, std_distance, sequence_ids, outlier_indices, alignment_name, output_dir):
+    """Generate a plot showing the distribution of average distances and outliers on a reused figure."""
+    fig.clear()
+    ax = fig.add_subplot(111)
     
     # Scatter plot of average distances
-    plt.scatter(range(len(avg_distances)), avg_distances, alpha=0.7)
+    ax.scatter(range(len(avg_distances)), avg_distances, alpha=0.7)
     
     # Highlight outliers
-    outlier_indices = [sequence_ids.index(outlier[0]) for outlier in outliers]
-    if outlier_indices:
-        plt.scatter(outlier_indices, [avg_distances[i] for i in outlier_indices], 
+    if len(outlier_indices):
+        ax.scatter(outlier_indices, avg_distances[outlier_indices], 
                    color='red', s=100, label='Outliers')
     
     # Add labels and other visual elements
-    plt.axhline(y=np.mean(avg_distances), color='green', linestyle='-', 
-               label=f'Mean distance: {np.mean(avg_distances):.4f}')
-    plt.axhline(y=np.mean(avg_distances) + 3 * np.std(avg_distances), color='orange', 
-               linestyle='--', label='3σ threshold')
+    sigma_threshold = mean_distance + 3 * std_distance
+    ax.axhline(y=mean_distance, color='green', linestyle='-', 
+               label=f'Mean distance: {mean_distance:.4f}')
+    ax.axhline(y=sigma_threshold, color='orange', 
+               linestyle='--', label=f'3σ threshold: {sigma_threshold:.4f}')
     
-    plt.xlabel('Sequence Index')
-    plt.ylabel('Average Distance to Other Sequences')
-    plt.title(f'Distance Distribution - {alignment_name}')
-    plt.legend()
-    plt.grid(True, alpha=0.3)
+    ax.set_xlabel('Sequence Index')
+    ax.set_ylabel('Average Distance to Other Sequences')
+    ax.set_title(f'Distance Distribution - {alignment_name}')
+    ax.legend()
+    ax.grid(True, alpha=0.3)
     
     # Add sequence IDs for outliers as annotations
     for i in outlier_indices:
-        plt.annotate(sequence_ids[i], (i, avg_distances[i]), 
+        ax.annotate(sequence_ids[i], (i, avg_distances[i]), 
                     textcoords="offset points", xytext=(0,10), ha='center')
     
     # Add a small plot showing z-score distribution
-    ax2 = plt.axes([0.15, 0.15, 0.3, 0.3])  # [left, bottom, width, height]
+    ax2 = fig.add_axes([0.15, 0.15, 0.3, 0.3])  # [left, bottom, width, height]
     ax2.hist(z_scores, bins=10, alpha=0.7)
     ax2.axvline(x=3.0, color='red', linestyle='--', label='Z=3')
     ax2.set_title('Z-score Distribution')
     
     # Save the plot
     plot_path = os.path.join(output_dir, f"{alignment_name}_distance_plot.png")
-    plt.savefig(plot_path)
-    
-    # Show plot if requested
-    if show_plot:
-        plt.show()
-    else:
-        plt.close()
+    fig.savefig(plot_path)
     
     return plot_path
 
-def process_alignment_file(file_path, output_dir, z_threshold=3.0, generate_plot=False, show_plot=False):
-    """Process a single alignment file and detect outliers."""
-    alignment = load_alignment(file_path)
-    if alignment is None:
-        return None
+def process_alignment_file(file_path, output_dir, z_threshold=3.0, generate_plot=False, plot_all=False,
+                           use_gpu=False, sequence_ids=None, arr=None, distance_matrix=None):
+    """
+    Process a single alignment file and detect outliers.
+    Plots are only drawn for alignments with outliers unless plot_all is set.
+    An already loaded alignment and its distances may be passed in to skip those steps.
+    """
+    if arr is None:
+        print(f"Processing {file_path}...")
+        sequence_ids, arr = load_alignment(file_path)
+        if arr is None:
+            return None
     
     # Extract alignment information
     alignment_name = os.path.basename(file_path).split('.')[0]
-    sequence_ids = [record.id for record in alignment]
     
     # Calculate distance matrix
-    distance_matrix = calculate_distance_matrix(alignment)
+    if distance_matrix is None:
+        distance_matrix = calculate_distance_matrix(arr, use_gpu=use_gpu)
     if distance_matrix is None:
         return None
     
     # Find potential outliers
-    outliers, avg_distances, z_scores = analyze_distances(
+    outliers, avg_distances, z_scores, outlier_indices, mean_distance, std_distance = analyze_distances(
         distance_matrix, sequence_ids, z_threshold)
+    # Only the per-sequence summaries are needed from here on; free the distances now
+    del distance_matrix
     
     # Generate report
     results = {
         "alignment_name": alignment_name,
         "file_path": file_path,
-        "num_sequences": len(alignment),
-        "alignment_length": alignment.get_alignment_length(),
+        "num_sequences": arr.shape[0],
+        "alignment_length": arr.shape[1],
         "outliers": outliers,
         "plot_path": None
     }
     
-    # Generate plot if requested
-    if generate_plot:
+    # Generate plot if requested; a plot without outliers adds little, so skip it unless asked
+    if generate_plot and (outliers or plot_all):
         plot_path = plot_distance_distribution(
-            avg_distances, z_scores, sequence_ids, outliers, 
-            alignment_name, output_dir, show_plot)
+            get_plot_figure(), avg_distances, z_scores, mean_distance, std_distance, sequence_ids, outlier_indices, 
+            alignment_name, output_dir)
         results["plot_path"] = plot_path
     
     return results
 
+def process_alignment_batch(file_paths, output_dir, z_threshold=3.0, generate_plot=False, plot_all=False,
+                            use_gpu=False):
+    """Process a batch of alignment files, sharing distance calculations between same-length alignments."""
+    loaded = []
+    for file_path in file_paths:
+        print(f"Processing {file_path}...")
+        sequence_ids, arr = load_alignment(file_path)
+        if arr is not None:
+            loaded.append((file_path, sequence_ids, arr))
+    
+    distances = calculate_distance_matrices([arr for _, _, arr in loaded], use_gpu)
+    
+    results = {file_path: None for file_path in file_paths}
+    for k in range(len(loaded)):
+        # Drop the batch's references so each alignment is freed as soon as it has been analyzed
+        (file_path, sequence_ids, arr), loaded[k] = loaded[k], None
+        distance_matrix, distances[k] = distances[k], None
+        if distance_matrix is None:
+            continue
+        results[file_path] = process_alignment_file(
+            file_path, output_dir, z_threshold, generate_plot, plot_all, use_gpu,
+            sequence_ids=sequence_ids, arr=arr, distance_matrix=distance_matrix)
+        del arr, distance_matrix
+    return list(results.values())
+
+def format_report_section(result):
+    """Format one alignment's section of the summary report as a single string."""
+    parts = [
+        f"Alignment: {result['alignment_name']}\n",
+        f"File: {result['file_path']}\n",
+        f"Sequences: {result['num_sequences']}\n",
+        f"Alignment Length: {result['alignment_length']}\n",
+    ]
+    
+    if result['outliers']:
+        parts.append("\nPotential outlier sequences:\n")
+        parts.extend([f"  - {seq_id}: Avg Distance = {avg_dist:.4f}, Z-score = {z_score:.4f}\n"
+                      for seq_id, avg_dist, z_score in result['outliers']])
+        
+        if result['plot_path']:
+            parts.append(f"\nDistance plot saved to: {result['plot_path']}\n")
+    else:
+        parts.append("\nNo outlier sequences detected.\n")
+    
+    parts.append("\n" + "-"*50 + "\n\n")
+    return "".join(parts)
+
 def write_report(results, output_dir):
-    """Write a summary report of all processed alignments."""
+    """
+    Write a summary report of all processed alignments.
+    Results may be any iterable; each section is written as soon as its result arrives.
+    Returns the report path and the paths of any plots listed in it.
+    """
     report_path = os.path.join(output_dir, "outlier_report.txt")
+    plot_paths = []
     with open(report_path, 'w') as f:
         f.write("OUTLIER SEQUENCE ANALYSIS REPORT\n")
         f.write("===============================\n\n")
@@ -168,37 +522,43 @@ def write_report(results, output_dir):
         for result in results:
             if result is None:
                 continue
-                
-            f.write(f"Alignment: {result['alignment_name']}\n")
-            f.write(f"File: {result['file_path']}\n")
-            f.write(f"Sequences: {result['num_sequences']}\n")
-            f.write(f"Alignment Length: {result['alignment_length']}\n")
             
-            if result['outliers']:
-                found_outliers = True
-                f.write("\nPotential outlier sequences:\n")
-                for seq_id, avg_dist, z_score in result['outliers']:
-                    f.write(f"  - {seq_id}: Avg Distance = {avg_dist:.4f}, Z-score = {z_score:.4f}\n")
-                
-                if result['plot_path']:
-                    f.write(f"\nDistance plot saved to: {result['plot_path']}\n")
-            else:
-                f.write("\nNo outlier sequences detected.\n")
-            
-            f.write("\n" + "-"*50 + "\n\n")
+            found_outliers = found_outliers or bool(result['outliers'])
+            if result['plot_path']:
+                plot_paths.append(result['plot_path'])
+            f.write(format_report_section(result))
+            # Flush so the report reflects finished alignments while the rest are still running
+            f.flush()
         
         if not found_outliers:
             f.write("No outlier sequences were detected in any alignments.\n")
     
     print(f"Report saved to {report_path}")
-    return report_path
+    return report_path, plot_paths
+
+def init_worker(numba_threads):
+    """
+    Switch worker processes to a non-interactive backend; GUI backends are not fork-safe.
+    Each worker's Numba thread count is capped so the pool as a whole does not oversubscribe the cores.
+    """
+    plt.switch_backend('Agg')
+    if HAVE_NUMBA:
+        # Never ask for more than the threads Numba started with (NUMBA_NUM_THREADS)
+        set_num_threads(min(numba_threads, numba_config.NUMBA_NUM_THREADS))
+
+def show_saved_plots(plot_paths):
+    """Display the saved distance plots interactively from the main process."""
+    for plot_path in plot_paths:
+        plt.figure(figsize=(12, 8))
+        plt.imshow(plt.imread(plot_path))
+        plt.axis('off')
+        plt.show()
 
 def setup_matplotlib():
     """Configure matplotlib to work in various environments."""
     # Try to set a backend that works in most environments
     try:
         # For systems with a GUI
-        import matplotlib
         if os.environ.get('DISPLAY'):
             matplotlib.use('TkAgg')  # Good for Linux with display
         elif os.name == 'nt':  # Windows
@@ -217,17 +577,27 @@ def main():
     """Main function to process all alignment files in the current directory."""
     args = parse_arguments()
     
-    # Setup matplotlib if we want to show plots
+    # Only probe for an interactive backend when plots will be shown; Agg skips GUI toolkit imports
     if args.show_plots:
         setup_matplotlib()
+    else:
+        matplotlib.use('Agg')
+    
+    use_gpu = args.gpu and _load_cupy() is not None
+    if args.gpu and not use_gpu:
+        print("Warning: CuPy is not installed or no GPU is usable; distance matrices will be calculated on the CPU.")
     
     # Create output directory if it doesn't exist
     os.makedirs(args.output_dir, exist_ok=True)
     
-    # Get list of FASTA files in current directory
+    # Get list of FASTA files in the input directory with a single directory scan
+    fasta_extensions = {'.fasta', '.fa', '.faa', '.fna', '.aln', '.fas'}
     input_files = []
-    for ext in ['.fasta', '.fa', '.faa', '.fna', '.aln', '.fas']:
-        input_files.extend(list(Path(args.input_dir).glob(f'*{ext}')))
+    if os.path.isdir(args.input_dir):
+        input_files = sorted(
+            Path(entry.path) for entry in os.scandir(args.input_dir)
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in fasta_extensions
+        )
     
     if not input_files:
         print(f"No FASTA files found in {args.input_dir}")
@@ -235,24 +605,43 @@ def main():
     
     print(f"Found {len(input_files)} alignment files to process.")
     
-    # Process each alignment file
-    results = []
-    for file_path in input_files:
-        print(f"Processing {file_path}...")
-        result = process_alignment_file(
-            file_path, args.output_dir, 
-            z_threshold=args.z_threshold, 
-            generate_plot=args.plot,
-            show_plot=args.show_plots
-        )
-        results.append(result)
-    
-    # Write summary report
-    write_report(results, args.output_dir)
+    # Small same-length alignments are grouped so they can share a distance calculation;
+    # plots are only displayed from the main process
+    batches = group_alignment_files(input_files)
+    n_workers = min(os.cpu_count() or 1, len(batches))
+    if use_gpu:
+        # Each worker would create its own CUDA context and tile buffers, so share the GPU from one process
+        n_workers = 1
+    worker = functools.partial(
+        process_alignment_batch,
+        output_dir=args.output_dir,
+        z_threshold=args.z_threshold,
+        generate_plot=args.plot or args.plot_all,
+        plot_all=args.plot_all,
+        use_gpu=use_gpu
+    )
+    if n_workers == 1:
+        # A single worker gains nothing from a pool, and spawning one re-imports every dependency
+        results = results_in_input_order(input_files, batches, map(worker, batches))
+        report_path, plot_paths = write_report(results, args.output_dir)
+    else:
+        # Spawn rather than fork: the Numba kernels compile at import, which starts its threading
+        # layer, and forking a process in that state can deadlock
+        numba_threads = max(1, (os.cpu_count() or 1) // n_workers)
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(numba_threads,),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            # Tasks are single files or small groups, so the report is written almost file by file as
+            # results arrive rather than after collecting every result. Grouping can move a file's task
+            # ahead of earlier files, so results are put back into sorted input order first
+            results = results_in_input_order(input_files, batches, executor.map(worker, batches))
+            report_path, plot_paths = write_report(results, args.output_dir)
     print("Analysis complete!")
     
+    if args.show_plots:
+        show_saved_plots(plot_paths)
+    
     # Print instructions for viewing saved plots
-    if args.plot and not args.show_plots:
+    if (args.plot or args.plot_all) and not args.show_plots:
         print("\nPlots have been saved to the output directory but were not displayed.")
         print(f"You can find them in: {os.path.abspath(args.output_dir)}")
         print("To view plots interactively during analysis, run with --show_plots flag")
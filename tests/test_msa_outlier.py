@@ -0,0 +1,79 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from scipy.spatial.distance import pdist
+
+# Run the kernels as plain Python so importing the script neither compiles nor writes to its Numba cache
+os.environ.setdefault('NUMBA_DISABLE_JIT', '1')
+
+_spec = importlib.util.spec_from_file_location(
+    'msa_outlier', Path(__file__).resolve().parent.parent / '10_msa_outlier.py')
+msa_outlier = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(msa_outlier)
+
+
+def equidistant_alignment(n_sequences, length, substitutions):
+    """Give each sequence its own substitutions on a shared base, so all average distances are equal."""
+    rng = np.random.default_rng(0)
+    base = rng.choice(np.frombuffer(b'ACGT', dtype=np.uint8), size=length)
+    arr = np.tile(base, (n_sequences, 1))
+    for i in range(n_sequences):
+        sites = slice(i * substitutions, (i + 1) * substitutions)
+        arr[i, sites] = np.where(arr[i, sites] == ord('A'), ord('C'), ord('A'))
+    return arr
+
+
+class EquidistantAlignmentTest(unittest.TestCase):
+
+    def assert_no_outliers(self, arr, z_threshold):
+        distances = pdist(arr, metric='hamming').astype(np.float32)
+        ids = [f's{i}' for i in range(arr.shape[0])]
+        outliers, avg_distances, z_scores, _, _, _ = msa_outlier.analyze_distances(distances, ids, z_threshold)
+        self.assertEqual(len(np.unique(avg_distances)), 1)
+        self.assertEqual(outliers, [])
+
+    def test_single_substitution(self):
+        self.assert_no_outliers(equidistant_alignment(206, 268, 1), 3.0)
+
+    def test_several_substitutions(self):
+        self.assert_no_outliers(equidistant_alignment(80, 1000, 7), 2.5)
+
+    def test_round_off_spread(self):
+        # Two average distances one float32 ulp above the rest are round-off, not a spread worth z-scoring
+        n_sequences = 50
+        distances = np.full(n_sequences * (n_sequences - 1) // 2, 1 / 134, dtype=np.float32)
+        distances[-1] *= np.float32(1 + n_sequences * np.finfo(np.float32).eps)
+        ids = [f's{i}' for i in range(n_sequences)]
+        outliers, _, z_scores, _, _, _ = msa_outlier.analyze_distances(distances, ids, 3.0)
+        self.assertEqual(outliers, [])
+        self.assertFalse(z_scores.any())
+
+
+class ReadFastaTest(unittest.TestCase):
+
+    def test_whitespace_inside_sequence_lines(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'aln.fasta')
+            with open(path, 'wb') as handle:
+                handle.write(b'>a desc\nAC\tGT \r\n>b\nAC GA\n')
+            ids, arr = msa_outlier.load_alignment(path)
+        self.assertEqual(ids, ['a', 'b'])
+        self.assertEqual([row.tobytes() for row in arr], [b'ACGT', b'ACGA'])
+
+
+class ResultsInInputOrderTest(unittest.TestCase):
+
+    def test_grouped_tasks_are_reordered(self):
+        file_paths = ['g0', 'g1', 'g2', 'g3', 'g4', 'g5']
+        tasks = [['g0', 'g1', 'g2', 'g4'], ['g3'], ['g5']]
+        task_results = [[f'{path} done' for path in task] for task in tasks]
+        results = msa_outlier.results_in_input_order(file_paths, tasks, task_results)
+        self.assertEqual(list(results), [f'{path} done' for path in file_paths])
+
+
+if __name__ == '__main__':
+    unittest.main()